@@ -1,17 +1,21 @@
 #!/usr/bin/env python3
 """Quick check: what columns does EXU_PRICEELEMENTRATES actually have?
-Runs via pyodbc to AXDB50."""
-import subprocess, sys
+Runs via pyodbc to AXDB50 (Windows Python — Trusted_Connection needs Kerberos)."""
+import pyodbc
+
+CONNECTION_STRING = (
+    "DRIVER={ODBC Driver 17 for SQL Server};SERVER=xel2012;DATABASE=AXDB50;Trusted_Connection=yes"
+)
 
-# Use sqlcmd.exe from Windows side (has Kerberos)
 query = """
 SELECT COLUMN_NAME, DATA_TYPE, CHARACTER_MAXIMUM_LENGTH
 FROM INFORMATION_SCHEMA.COLUMNS
 WHERE TABLE_NAME = 'EXU_PRICEELEMENTRATES'
 ORDER BY ORDINAL_POSITION;
 """
-cmd = ['sqlcmd.exe', '-S', 'xel2012', '-d', 'AXDB50', '-Q', query, '-W', '-s', '|']
-result = subprocess.run(cmd, capture_output=True, text=True, timeout=15)
-print(result.stdout)
-if result.stderr:
-    print("STDERR:", result.stderr, file=sys.stderr)
+with pyodbc.connect(CONNECTION_STRING, timeout=15) as conn:
+    cur = conn.cursor()
+    cur.execute(query)
+    print("|".join(col[0] for col in cur.description))
+    for row in cur:
+        print("|".join("NULL" if c is None else str(c) for c in row))
@@ -1,10 +1,62 @@
 #!/usr/bin/env python3
 """Compare WattsOn extraction (prod-*.json) vs Xellent reference (xellent-*.json)."""
 
-import json
 import sys
+from operator import itemgetter
 from pathlib import Path
 
+import numpy as np
+
+try:
+    from orjson import loads
+except ImportError:  # orjson is optional; stdlib json accepts bytes too
+    from json import loads
+
+# Above this many tariff lines per side, a dict join beats the sort-merge join
+MERGE_JOIN_MAX_LINES = 32
+
+charge_id = itemgetter("partyChargeTypeId")
+
+def sorted_last_per_id(lines: list) -> list:
+    """Lines sorted by chargeId, keeping only the last line per ID (as the dict join does)."""
+    out = []
+    for t in sorted(lines, key=charge_id):  # stable: the last duplicate sorts last within its run
+        if out and charge_id(out[-1]) == charge_id(t):
+            out[-1] = t
+        else:
+            out.append(t)
+    return out
+
+def join_tariff_lines(w_lines: list, x_lines: list):
+    """Yield (chargeId, wattsonLine, xellentLine) in chargeId order; a missing side is None."""
+    if len(w_lines) > MERGE_JOIN_MAX_LINES or len(x_lines) > MERGE_JOIN_MAX_LINES:
+        w_tariffs = {charge_id(t): t for t in w_lines}
+        x_tariffs = {charge_id(t): t for t in x_lines}
+        for tid in sorted(w_tariffs.keys() | x_tariffs.keys()):
+            yield tid, w_tariffs.get(tid), x_tariffs.get(tid)
+        return
+    
+    # Typical settlements have <10 lines: merge two sorted lists instead of hashing
+    wl = sorted_last_per_id(w_lines)
+    xl = sorted_last_per_id(x_lines)
+    i = j = 0
+    while i < len(wl) and j < len(xl):
+        wid, xid = charge_id(wl[i]), charge_id(xl[j])
+        if wid == xid:
+            yield wid, wl[i], xl[j]
+            i += 1
+            j += 1
+        elif wid < xid:
+            yield wid, wl[i], None
+            i += 1
+        else:
+            yield xid, None, xl[j]
+            j += 1
+    for t in wl[i:]:
+        yield charge_id(t), t, None
+    for t in xl[j:]:
+        yield charge_id(t), None, t
+
 def main():
     wattson_path = Path(sys.argv[1]) if len(sys.argv) > 1 else Path("./cache/prod-405013.json")
     xellent_path = Path(sys.argv[2]) if len(sys.argv) > 2 else Path("./cache/reports/xellent-405013.json")
@@ -12,10 +64,10 @@ def main():
     print(f"WattsOn: {wattson_path}")
     print(f"Xellent: {xellent_path}")
     
-    with open(wattson_path) as f:
-        w_data = json.load(f)
-    with open(xellent_path) as f:
-        x_data = json.load(f)
+    with open(wattson_path, "rb") as f:
+        w_data = loads(f.read())
+    with open(xellent_path, "rb") as f:
+        x_data = loads(f.read())
     
     # Index settlements by histKeyNumber
     w_by_key = {}
@@ -28,65 +80,63 @@ def main():
         key = s.get("histKeyNumber", "").strip()
         x_by_key[key] = s
     
-    all_keys = sorted(set(w_by_key.keys()) | set(x_by_key.keys()))
+    # Dict key views support set operations directly, no copies needed
+    wk = w_by_key.keys()
+    xk = x_by_key.keys()
+    all_keys = sorted(wk | xk)
+    common = sorted(wk & xk)
+    pos = {key: i for i, key in enumerate(common)}
     
     print(f"\nWattsOn settlements: {len(w_by_key)}")
     print(f"Xellent settlements: {len(x_by_key)}")
-    print(f"Common keys: {len(set(w_by_key.keys()) & set(x_by_key.keys()))}")
-    print(f"Only in WattsOn: {len(set(w_by_key.keys()) - set(x_by_key.keys()))}")
-    print(f"Only in Xellent: {len(set(x_by_key.keys()) - set(w_by_key.keys()))}")
+    print(f"Common keys: {len(common)}")
+    print(f"Only in WattsOn: {len(wk - xk)}")
+    print(f"Only in Xellent: {len(xk - wk)}")
     
     print("\n" + "="*120)
     print(f"{'Key':>12}  {'Period':>22}  {'W kWh':>10}  {'X kWh':>10}  {'ΔkWh':>8}  {'W Spot':>10}  {'X Spot':>10}  {'ΔSpot':>8}  {'W Margin':>10}  {'X Margin':>10}  {'ΔMargin':>8}  {'W Total':>10}  {'X Total':>10}  {'ΔTotal':>10}  {'Tariff Diffs'}")
     print("="*120)
     
+    # Numeric columns over the common keys, diffed in one vectorized pass
+    def column(by_key, field):
+        return np.fromiter((by_key[k].get(field, 0) for k in common), dtype=np.float64, count=len(common))
+    
+    w_kwh, x_kwh = column(w_by_key, "totalEnergyKwh"), column(x_by_key, "totalEnergyKwh")
+    w_spot, x_spot = column(w_by_key, "spotAmountDkk"), column(x_by_key, "spotAmountDkk")
+    w_margin, x_margin = column(w_by_key, "marginAmountDkk"), column(x_by_key, "marginAmountDkk")
+    w_total, x_total = column(w_by_key, "totalAmountDkk"), column(x_by_key, "totalAmountDkk")
+    d_kwh = w_kwh - x_kwh
+    d_spot = w_spot - x_spot
+    d_margin = w_margin - x_margin
+    d_total = w_total - x_total
+    amount_diff = (np.abs(d_kwh) > 0.001) | (np.abs(d_spot) > 0.01) | (np.abs(d_margin) > 0.01) | (np.abs(d_total) > 0.01)
+    
     total_diffs = 0
     total_amount_diff = 0
     exact_matches = 0
     tariff_diffs_total = 0
+    out = []  # rows are written in one go after the loop
     
     for key in all_keys:
         ws = w_by_key.get(key)
         xs = x_by_key.get(key)
         
         if not ws:
-            print(f"{key:>12}  MISSING in WattsOn")
+            out.append(f"{key:>12}  MISSING in WattsOn")
             total_diffs += 1
             continue
         if not xs:
-            print(f"{key:>12}  MISSING in Xellent")
+            out.append(f"{key:>12}  MISSING in Xellent")
             total_diffs += 1
             continue
         
+        i = pos[key]
         period = xs.get("periodStart", "")[:10]
         
-        w_kwh = ws.get("totalEnergyKwh", 0)
-        x_kwh = xs.get("totalEnergyKwh", 0)
-        d_kwh = w_kwh - x_kwh
-        
-        w_spot = ws.get("spotAmountDkk", 0)
-        x_spot = xs.get("spotAmountDkk", 0)
-        d_spot = w_spot - x_spot
-        
-        w_margin = ws.get("marginAmountDkk", 0)
-        x_margin = xs.get("marginAmountDkk", 0)
-        d_margin = w_margin - x_margin
-        
-        w_total = ws.get("totalAmountDkk", 0)
-        x_total = xs.get("totalAmountDkk", 0)
-        d_total = w_total - x_total
-        
         # Compare tariff lines
-        w_tariffs = {t["partyChargeTypeId"]: t for t in ws.get("tariffLines", [])}
-        x_tariffs = {t["partyChargeTypeId"]: t for t in xs.get("tariffLines", [])}
-        
-        all_tariff_ids = sorted(set(w_tariffs.keys()) | set(x_tariffs.keys()))
         tariff_diff_notes = []
         
-        for tid in all_tariff_ids:
-            wt = w_tariffs.get(tid)
-            xt = x_tariffs.get(tid)
-            
+        for tid, wt, xt in join_tariff_lines(ws.get("tariffLines", []), xs.get("tariffLines", [])):
             if not wt:
                 tariff_diff_notes.append(f"+X:{tid}={xt['amountDkk']:.2f}")
                 tariff_diffs_total += 1
@@ -99,18 +149,18 @@ def main():
                     tariff_diff_notes.append(f"Δ{tid}={wt['amountDkk']-xt['amountDkk']:+.2f}")
                     tariff_diffs_total += 1
         
-        has_diff = abs(d_kwh) > 0.001 or abs(d_spot) > 0.01 or abs(d_margin) > 0.01 or abs(d_total) > 0.01 or len(tariff_diff_notes) > 0
-        
-        if has_diff:
+        if amount_diff[i] or tariff_diff_notes:
             total_diffs += 1
-            total_amount_diff += d_total
+            total_amount_diff += float(d_total[i])
             tariff_str = "; ".join(tariff_diff_notes[:5])
             if len(tariff_diff_notes) > 5:
                 tariff_str += f" +{len(tariff_diff_notes)-5} more"
-            print(f"{key:>12}  {period:>22}  {w_kwh:>10.2f}  {x_kwh:>10.2f}  {d_kwh:>+8.2f}  {w_spot:>10.2f}  {x_spot:>10.2f}  {d_spot:>+8.2f}  {w_margin:>10.2f}  {x_margin:>10.2f}  {d_margin:>+8.2f}  {w_total:>10.2f}  {x_total:>10.2f}  {d_total:>+10.2f}  {tariff_str}")
+            out.append(f"{key:>12}  {period:>22}  {w_kwh[i]:>10.2f}  {x_kwh[i]:>10.2f}  {d_kwh[i]:>+8.2f}  {w_spot[i]:>10.2f}  {x_spot[i]:>10.2f}  {d_spot[i]:>+8.2f}  {w_margin[i]:>10.2f}  {x_margin[i]:>10.2f}  {d_margin[i]:>+8.2f}  {w_total[i]:>10.2f}  {x_total[i]:>10.2f}  {d_total[i]:>+10.2f}  {tariff_str}")
         else:
             exact_matches += 1
     
+    if out:
+        sys.stdout.write("\n".join(out) + "\n")
     print("="*120)
     print(f"\nSUMMARY:")
     print(f"  Total settlements compared: {len(all_keys)}")
@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 """
 Fetch historical spot prices from Energi Data Service and cache locally.
-Usage: python3 fetch-spot-prices.py [--area DK1] [--from 2020-01-01] [--to 2025-10-02] [--cache cache/spot-prices.json]
+Usage: python3 fetch-spot-prices.py [--area DK1] [--from 2020-01-01] [--to 2025-10-02] [--cache cache/spot-prices.json.zst]
 
-Fetches in batches of 10,000 records, writes to a JSON cache file.
+Fetches in batches of 10,000 records (paged concurrently, rate limited), writes to a cache file:
+zstd-compressed JSON for *.zst paths (needs the zstandard package), indented JSON otherwise.
 Re-running with an existing cache file will only fetch missing date ranges.
 """
 
@@ -11,95 +12,204 @@ import argparse
 import json
 import os
 import sys
+import threading
 import time
-import urllib.request
-import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
+from operator import itemgetter
+
+import numpy as np
+import requests
+
+try:
+    import orjson
+    loads = orjson.loads
+    dumps = orjson.dumps
+
+    def dumps_indented(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+except ImportError:  # orjson is optional; fall back to stdlib json
+    loads = json.loads
+
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+    def dumps_indented(obj) -> bytes:
+        return json.dumps(obj, indent=2).encode()
+
+try:
+    import zstandard
+except ImportError:  # only needed for .zst cache files
+    zstandard = None
 
 API_BASE = "https://api.energidataservice.dk/dataset/Elspotprices"
 BATCH_SIZE = 10000
+MAX_WORKERS = 8
+MAX_REQUESTS_PER_SEC = 4  # Be nice to the API
+MAX_BACKOFF_SEC = 60
+MAX_ATTEMPTS = 8  # per page, then the last error is raised
+ZSTD_LEVEL = 3
 
-def fetch_batch(area: str, start: str, end: str, offset: int) -> dict:
-    """Fetch a batch of spot prices from Energi Data Service."""
-    params = {
-        "offset": offset,
+class RateLimiter:
+    """Spaces request starts so at most `rate` begin per second across all threads."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self.next_allowed = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_allowed - now
+            self.next_allowed = max(now, self.next_allowed) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+class FetchCancelled(Exception):
+    """Raised in a worker once the run is stopping (Ctrl-C or a page that failed for good)."""
+
+_thread_local = threading.local()
+
+def get_session() -> requests.Session:
+    """Keep-alive session for the current worker thread (one TCP/TLS connection reused across pages)."""
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = _thread_local.session = requests.Session()
+        session.headers.update({"Accept": "application/json", "Accept-Encoding": "gzip, deflate"})
+    return session
+
+def base_params(area: str, start: str, end: str) -> dict:
+    """Query parameters shared by every page of a run — only the offset differs."""
+    return {
         "limit": BATCH_SIZE,
         "start": start,
         "end": end,
         "filter": json.dumps({"PriceArea": [area]}),
         "sort": "HourUTC ASC",
     }
-    url = f"{API_BASE}?{urllib.parse.urlencode(params)}"
-    
-    req = urllib.request.Request(url, headers={"Accept": "application/json"})
-    with urllib.request.urlopen(req, timeout=30) as resp:
-        return json.loads(resp.read())
+
+def fetch_batch(params: dict, offset: int) -> dict:
+    """Fetch a batch of spot prices from Energi Data Service."""
+    resp = get_session().get(API_BASE, params={**params, "offset": offset}, timeout=30)
+    resp.raise_for_status()
+    return loads(resp.content)
+
+def is_transient(e: requests.RequestException) -> bool:
+    """HTTP 429/5xx, connection errors and timeouts are worth retrying; other 4xx are not."""
+    if isinstance(e, requests.HTTPError):
+        status = e.response.status_code if e.response is not None else 0
+        return status == 429 or status >= 500
+    return isinstance(e, (requests.ConnectionError, requests.Timeout))
+
+def fetch_with_retry(limiter: RateLimiter, params: dict, offset: int, stop: threading.Event) -> dict:
+    """Fetch a batch, retrying transient failures with exponential backoff until `stop` is set."""
+    backoff = 2
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        if stop.is_set():
+            raise FetchCancelled(f"offset {offset}")
+        limiter.wait()
+        try:
+            return fetch_batch(params, offset)
+        except requests.RequestException as e:
+            if not is_transient(e) or attempt == MAX_ATTEMPTS:
+                raise
+            print(f"  Error at offset {offset}: {e} — retrying in {backoff}s ({attempt}/{MAX_ATTEMPTS})")
+            stop.wait(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF_SEC)
+
+def require_zstandard(path: str):
+    if zstandard is None:
+        sys.exit(f"{path}: .zst caches need the zstandard package (pip install zstandard) — or use a .json path")
+
+def read_cache(path: str) -> dict:
+    """Load a spot-price cache file (zstd-compressed if the path ends in .zst)."""
+    with open(path, "rb") as f:
+        raw = f.read()
+    if path.endswith(".zst"):
+        require_zstandard(path)
+        raw = zstandard.ZstdDecompressor().decompress(raw)
+    return loads(raw)
+
+def write_cache(path: str, cache: dict):
+    """Write a spot-price cache file: compact zstd-compressed JSON for .zst, indented JSON otherwise."""
+    if path.endswith(".zst"):
+        require_zstandard(path)
+        raw = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(dumps(cache))
+    else:
+        raw = dumps_indented(cache)
+    with open(path, "wb") as f:
+        f.write(raw)
 
 def main():
     parser = argparse.ArgumentParser(description="Fetch historical spot prices")
     parser.add_argument("--area", default="DK1", help="Price area (DK1 or DK2)")
     parser.add_argument("--from", dest="from_date", default="2020-01-01", help="Start date (YYYY-MM-DD)")
     parser.add_argument("--to", dest="to_date", default="2025-10-02", help="End date (YYYY-MM-DD)")
-    parser.add_argument("--cache", default="cache/spot-prices.json", help="Cache file path")
+    parser.add_argument("--cache", default="cache/spot-prices.json.zst", help="Cache file path (.json or .json.zst)")
     args = parser.parse_args()
+    if args.cache.endswith(".zst"):
+        require_zstandard(args.cache)  # fail before downloading, not after
 
     # Load existing cache
     cache = {"area": args.area, "fromDate": args.from_date, "toDate": args.to_date, "prices": []}
     if os.path.exists(args.cache):
-        with open(args.cache) as f:
-            cache = json.load(f)
+        cache = read_cache(args.cache)
         print(f"Loaded existing cache: {len(cache['prices'])} prices ({cache['fromDate']} → {cache['toDate']})")
 
-    # Build set of existing hours for dedup
-    existing_hours = {p["hourUtc"] for p in cache["prices"]}
-    
-    # Fetch
-    offset = 0
-    new_count = 0
-    total = None
-    
-    print(f"Fetching {args.area} spot prices: {args.from_date} → {args.to_date}")
+    # Index prices by hour for dedup; materialized as a sorted list only when writing
+    prices_by_hour = {p["hourUtc"]: p for p in cache["prices"]}
     
-    while True:
-        try:
-            data = fetch_batch(args.area, args.from_date, args.to_date, offset)
-        except Exception as e:
-            print(f"  Error at offset {offset}: {e}")
-            time.sleep(2)
-            continue
-            
-        if total is None:
-            total = data["total"]
-            print(f"  Total records available: {total}")
-        
-        records = data.get("records", [])
-        if not records:
-            break
-            
+    def merge(records) -> int:
+        added = 0
         for r in records:
             hour_utc = r["HourUTC"]
-            if hour_utc not in existing_hours:
-                cache["prices"].append({
+            if hour_utc not in prices_by_hour:
+                prices_by_hour[hour_utc] = {
                     "hourUtc": hour_utc,
                     "hourDk": r["HourDK"],
                     "area": r["PriceArea"],
                     "spotPriceDkk": r["SpotPriceDKK"],  # DKK per MWh
                     "spotPriceEur": r["SpotPriceEUR"],
-                })
-                existing_hours.add(hour_utc)
-                new_count += 1
-        
-        offset += len(records)
-        pct = min(100, offset * 100 / total) if total else 0
-        print(f"  Fetched {offset}/{total} ({pct:.0f}%) — {new_count} new", end="\r")
-        
-        if len(records) < BATCH_SIZE:
-            break
-            
-        time.sleep(0.5)  # Be nice to the API
+                }
+                added += 1
+        return added
+    
+    # Fetch: the first page tells us the total, the remaining pages are fetched concurrently.
+    # Results are merged on the main thread as they complete, so no locking is needed.
+    limiter = RateLimiter(MAX_REQUESTS_PER_SEC)
+    stop = threading.Event()
+    params = base_params(args.area, args.from_date, args.to_date)
+    
+    print(f"Fetching {args.area} spot prices: {args.from_date} → {args.to_date}")
+    
+    data = fetch_with_retry(limiter, params, 0, stop)
+    total = data["total"]
+    print(f"  Total records available: {total}")
+    
+    records = data.get("records", [])
+    fetched = len(records)
+    new_count = merge(records)
+    print(f"  Fetched {fetched}/{total} — {new_count} new", end="\r")
+    
+    offsets = range(BATCH_SIZE, total, BATCH_SIZE) if len(records) == BATCH_SIZE else range(0)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        futures = [pool.submit(fetch_with_retry, limiter, params, offset, stop) for offset in offsets]
+        try:
+            for future in as_completed(futures):
+                records = future.result().get("records", [])
+                fetched += len(records)
+                new_count += merge(records)
+                pct = min(100, fetched * 100 / total) if total else 0
+                print(f"  Fetched {fetched}/{total} ({pct:.0f}%) — {new_count} new", end="\r")
+        except BaseException:
+            # Ctrl-C or a failed page: stop retrying workers and drop queued pages instead of waiting them out
+            stop.set()
+            pool.shutdown(cancel_futures=True)
+            raise
     
     # Sort by hour
-    cache["prices"].sort(key=lambda p: p["hourUtc"])
+    cache["prices"] = sorted(prices_by_hour.values(), key=itemgetter("hourUtc"))
     cache["area"] = args.area
     cache["fromDate"] = args.from_date
     cache["toDate"] = args.to_date
@@ -108,19 +218,19 @@ def main():
     
     # Summary stats
     if cache["prices"]:
-        prices_dkk = [p["spotPriceDkk"] for p in cache["prices"] if p["spotPriceDkk"] is not None]
+        prices_dkk = np.fromiter(
+            (p["spotPriceDkk"] for p in cache["prices"] if p["spotPriceDkk"] is not None), dtype=np.float64)
         cache["stats"] = {
-            "min": min(prices_dkk),
-            "max": max(prices_dkk),
-            "avg": sum(prices_dkk) / len(prices_dkk),
+            "min": float(prices_dkk.min()),
+            "max": float(prices_dkk.max()),
+            "avg": float(prices_dkk.mean()),
             "first": cache["prices"][0]["hourUtc"],
             "last": cache["prices"][-1]["hourUtc"],
         }
     
     # Write cache
     os.makedirs(os.path.dirname(args.cache), exist_ok=True)
-    with open(args.cache, "w") as f:
-        json.dump(cache, f, indent=2)
+    write_cache(args.cache, cache)
     
     print(f"\n✅ Cache written: {args.cache}")
     print(f"   {len(cache['prices'])} total prices ({cache['prices'][0]['hourUtc'][:10]} → {cache['prices'][-1]['hourUtc'][:10]})")
@@ -1,89 +1,180 @@
 #!/usr/bin/env python3
-"""Generate self-contained interactive HTML settlement provenance report."""
+"""Generate self-contained interactive HTML settlement provenance report.
 
-import json
+Usage: python3 generate-report.py [cache/prod-405013.json] [cache/reports/settlement-provenance.html]
+An output path ending in .gz (e.g. report.html.gz) writes a gzip-compressed report for serving
+with Content-Encoding: gzip; plain .html output opens directly from disk.
+"""
+
+import gzip
 import sys
 from pathlib import Path
 
+try:
+    import orjson
+    loads = orjson.loads
+    dumps = orjson.dumps
+except ImportError:  # orjson is optional; fall back to stdlib json
+    import json
+    loads = json.loads
+
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(',', ':')).encode()
+
+try:
+    import ijson
+except ImportError:  # ijson is optional; without it the whole extraction is loaded at once
+    ijson = None
+
+HEADER_FIELDS = ("extractedAt", "supplierGln", "supplierName")
+
+
+def read_header(path: Path) -> dict:
+    """Read the top-level scalars (supplier, accounts, first customer name) of an extraction."""
+    header = {"accountNumbers": []}
+    with open(path, "rb") as f:
+        for prefix, event, value in ijson.parse(f):
+            if prefix in HEADER_FIELDS:
+                header[prefix] = value
+            elif prefix == "accountNumbers.item":
+                header["accountNumbers"].append(value)
+            elif prefix == "customers.item.name":
+                header.setdefault("customer", value)
+            elif prefix == "" and event == "map_key":
+                # Bulk data (products, time series, settlements) follows the header block
+                if value == "settlements" or ("customer" in header and all(k in header for k in HEADER_FIELDS)):
+                    break
+    header.setdefault("customer", "Unknown")
+    return header
+
+
+def iter_settlements(path: Path):
+    """Yield settlements one at a time without holding the full extraction in memory."""
+    with open(path, "rb") as f:
+        yield from ijson.items(f, "settlements.item", use_float=True)
+
+
+def read_extraction(path: Path):
+    """Return (header, settlements) for an extraction file, streaming when ijson is available."""
+    if ijson is not None:
+        return read_header(path), iter_settlements(path)
+
+    with open(path, "rb") as f:
+        data = loads(f.read())
+    header = {
+        "extractedAt": data.get("extractedAt"),
+        "accountNumbers": data.get("accountNumbers", []),
+        "supplierGln": data.get("supplierGln"),
+        "supplierName": data.get("supplierName"),
+        "customer": data["customers"][0]["name"] if data.get("customers") else "Unknown",
+    }
+    return header, data["settlements"]
+
+
+def dumps_embedded(obj) -> bytes:
+    """Serialize for the <script type="application/json"> block; "</" is escaped so no string can close the tag."""
+    return dumps(obj).replace(b"</", b"<\\/")
+
+
+def build_lean(s: dict, rate_tables: dict) -> dict:
+    """Reduce one extracted settlement to the fields the HTML report renders.
+
+    Hourly rate tables are interned into rate_tables (rates tuple → id); tariffs reference them by id.
+    """
+    # Hourly data is columnar ({ts, kwh, spot, calc} lists); Python round() keeps the 6th decimal
+    # correctly rounded (ndarray.round scales and divides, which can flip the last digit fmtP shows)
+    lines = s.get("hourlyLines", [])
+    hourly = {
+        "ts": [h["timestamp"] for h in lines],
+        "kwh": [round(h["kwh"], 6) for h in lines],
+        "spot": [round(h["spotPriceDkkPerKwh"], 6) for h in lines],
+        "calc": [round(h["calculatedPriceDkkPerKwh"], 6) for h in lines],
+    }
+    
+    tariffs = []
+    for t in s["tariffLines"]:
+        prov = t.get("rateProvenance")
+        tariff_obj = {
+            "id": t["partyChargeTypeId"],
+            "desc": t["description"],
+            "amount": round(t["amountDkk"], 4),
+            "energy": round(t["energyKwh"], 4),
+            "avg": round(t["avgUnitPrice"], 6)
+        }
+        if prov:
+            hourly_rates = prov.get("hourlyRates")
+            tariff_obj["prov"] = {
+                "startDate": prov["rateStartDate"],
+                "isHourly": prov["isHourly"],
+                "flat": prov["flatRate"],
+                "hourlyRef": None if hourly_rates is None else rate_tables.setdefault(tuple(hourly_rates), len(rate_tables)),
+                "candidates": prov["candidateRateCount"],
+                "rule": prov["selectionRule"]
+            }
+        tariffs.append(tariff_obj)
+    
+    return {
+        "gsrn": s["gsrn"],
+        "start": s["periodStart"],
+        "end": s["periodEnd"],
+        "log": s["billingLogNum"].strip() if isinstance(s["billingLogNum"], str) else s["billingLogNum"],
+        "key": s["histKeyNumber"].strip() if isinstance(s["histKeyNumber"], str) else s["histKeyNumber"],
+        "kwh": round(s["totalEnergyKwh"], 4),
+        "elec": round(s["electricityAmountDkk"], 4),
+        "spot": round(s["spotAmountDkk"], 4),
+        "margin": round(s["marginAmountDkk"], 4),
+        "total": round(s["totalAmountDkk"], 4),
+        "product": s.get("productName"),
+        "marginRate": s.get("marginRateDkkPerKwh"),
+        "hours": hourly,
+        "tariffs": tariffs
+    }
+
+
 def main():
     cache_path = Path(sys.argv[1]) if len(sys.argv) > 1 else Path("./cache/prod-405013.json")
     output_path = Path(sys.argv[2]) if len(sys.argv) > 2 else Path("./cache/reports/settlement-provenance.html")
     
     print(f"Reading {cache_path}...")
-    with open(cache_path) as f:
-        data = json.load(f)
+    header, settlements = read_extraction(cache_path)
     
     # Build lean report data
-    report_settlements = []
-    for s in data["settlements"]:
-        hourly = []
-        for h in s.get("hourlyLines", []):
-            hourly.append([
-                h["timestamp"],
-                round(h["kwh"], 6),
-                round(h["spotPriceDkkPerKwh"], 6),
-                round(h["calculatedPriceDkkPerKwh"], 6)
-            ])
-        
-        tariffs = []
-        for t in s["tariffLines"]:
-            prov = t.get("rateProvenance")
-            tariff_obj = {
-                "id": t["partyChargeTypeId"],
-                "desc": t["description"],
-                "amount": round(t["amountDkk"], 4),
-                "energy": round(t["energyKwh"], 4),
-                "avg": round(t["avgUnitPrice"], 6)
-            }
-            if prov:
-                tariff_obj["prov"] = {
-                    "startDate": prov["rateStartDate"],
-                    "isHourly": prov["isHourly"],
-                    "flat": prov["flatRate"],
-                    "hourly": prov.get("hourlyRates"),
-                    "candidates": prov["candidateRateCount"],
-                    "rule": prov["selectionRule"]
-                }
-            tariffs.append(tariff_obj)
-        
-        report_settlements.append({
-            "gsrn": s["gsrn"],
-            "start": s["periodStart"],
-            "end": s["periodEnd"],
-            "log": s["billingLogNum"].strip() if isinstance(s["billingLogNum"], str) else s["billingLogNum"],
-            "key": s["histKeyNumber"].strip() if isinstance(s["histKeyNumber"], str) else s["histKeyNumber"],
-            "kwh": round(s["totalEnergyKwh"], 4),
-            "elec": round(s["electricityAmountDkk"], 4),
-            "spot": round(s["spotAmountDkk"], 4),
-            "margin": round(s["marginAmountDkk"], 4),
-            "total": round(s["totalAmountDkk"], 4),
-            "product": s.get("productName"),
-            "marginRate": s.get("marginRateDkkPerKwh"),
-            "hours": hourly,
-            "tariffs": tariffs
-        })
-    
+    rate_tables = {}
+    report_settlements = [build_lean(s, rate_tables) for s in settlements]
     report_settlements.sort(key=lambda s: s["start"])
     
-    report_data = {
-        "extractedAt": data.get("extractedAt"),
-        "accounts": data.get("accountNumbers", []),
-        "supplierGln": data.get("supplierGln"),
-        "supplierName": data.get("supplierName"),
-        "customer": data["customers"][0]["name"] if data.get("customers") else "Unknown",
-        "settlements": report_settlements
+    report_meta = {
+        "extractedAt": header.get("extractedAt"),
+        "accounts": header.get("accountNumbers", []),
+        "supplierGln": header.get("supplierGln"),
+        "supplierName": header.get("supplierName"),
+        "customer": header["customer"],
+        "rateTables": [list(rates) for rates in rate_tables],  # dict order == id order
     }
     
-    report_json = json.dumps(report_data, separators=(',', ':'))
-    print(f"Report data: {len(report_json) / 1024 / 1024:.1f} MB, {len(report_settlements)} settlements")
-    
-    html = HTML_TEMPLATE.replace("__REPORT_DATA__", report_json)
-    
+    # Stream the report JSON one settlement at a time instead of serializing it as a whole:
+    # {<meta>,"settlements":[<s0>,<s1>,...]}
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(output_path, "w", encoding="utf-8") as f:
-        f.write(html)
+    compressed = output_path.suffix == ".gz"
+    with (gzip.open(output_path, "wb", compresslevel=6) if compressed else open(output_path, "wb")) as f:
+        f.write(HTML_HEAD)
+        data_start = f.tell()
+        f.write(dumps_embedded(report_meta)[:-1] + b',"settlements":[')
+        for i, s in enumerate(report_settlements):
+            if i:
+                f.write(b",")
+            f.write(dumps_embedded(s))
+        f.write(b"]}")
+        data_size = f.tell() - data_start
+        f.write(HTML_TAIL)
+        html_size = f.tell()
     
-    print(f"Report: {output_path.resolve()} ({len(html) / 1024 / 1024:.1f} MB)")
+    print(f"Report data: {data_size / 1024 / 1024:.1f} MB, {len(report_settlements)} settlements")
+    file_size = output_path.stat().st_size
+    if compressed:
+        print(f"Report: {output_path.resolve()} ({file_size / 1024 / 1024:.1f} MB gzip, {html_size / 1024 / 1024:.1f} MB HTML)")
+    else:
+        print(f"Report: {output_path.resolve()} ({file_size / 1024 / 1024:.1f} MB)")
 
 
 HTML_TEMPLATE = r'''<!DOCTYPE html>
@@ -172,11 +263,22 @@ summary:hover { color: var(--accent2); }
   </div>
   <div id="detail"><div class="empty">Vælg en afregning ovenfor</div></div>
 </div>
+<script type="application/json" id="wdata">__REPORT_DATA__</script>
 <script>
-const DATA = __REPORT_DATA__;
+const DATA = JSON.parse(document.getElementById('wdata').textContent);
 const S = DATA.settlements;
 
-const fmt = (v, d) => v == null ? '—' : v.toLocaleString('da-DK', {minimumFractionDigits: d||2, maximumFractionDigits: d||2});
+// Tariffs reference shared hourly rate tables by id; resolve them once up front
+S.forEach(function(s) {
+  s.tariffs.forEach(function(t) {
+    if (t.prov) t.prov.hourly = t.prov.hourlyRef == null ? null : DATA.rateTables[t.prov.hourlyRef];
+  });
+});
+
+// One Intl.NumberFormat per precision: constructing is expensive, .format() is cheap (unlike toLocaleString per call)
+const NF = {};
+const numFmt = d => NF[d] || (NF[d] = new Intl.NumberFormat('da-DK', {minimumFractionDigits: d, maximumFractionDigits: d}));
+const fmt = (v, d) => v == null ? '—' : numFmt(d||2).format(v);
 const fmtK = v => fmt(v, 4);
 const fmtP = v => fmt(v, 6);
 const pct = (v, t) => t === 0 ? '0%' : (v/t*100).toFixed(1) + '%';
@@ -212,6 +314,8 @@ function render() {
   
   var tariffTotal = s.tariffs.reduce(function(a,t){return a+t.amount;}, 0);
   var absTotal = Math.abs(s.spot) + Math.abs(s.margin) + Math.abs(tariffTotal);
+  var absT = Math.abs(s.total);
+  var hourOfDay = null;  // UTC hour per hourly row, parsed once and shared by all hourly tariffs
   
   // Detect warnings
   var flags = [];
@@ -220,120 +324,121 @@ function render() {
     if (t.prov && t.prov.candidates > 100) flags.push('⚠️ ' + t.desc + ': ' + t.prov.candidates + ' candidate rate rows — may be picking wrong rate');
   });
   
-  var h = '';
+  var h = [];
   
   // Overview card
-  h += '<div class="card"><div class="card-title">Afregning</div>';
-  h += '<div class="stats">';
-  h += '<div class="stat"><div class="val">'+ts(s.start)+'</div><div class="lbl">Periode start</div></div>';
-  h += '<div class="stat"><div class="val">'+ts(s.end)+'</div><div class="lbl">Periode slut</div></div>';
-  h += '<div class="stat"><div class="val">'+fmt(s.kwh,2)+'</div><div class="lbl">kWh</div></div>';
-  h += '<div class="stat"><div class="val">'+s.hours.length+'</div><div class="lbl">Timer</div></div>';
-  h += '<div class="stat"><div class="val total">'+fmt(s.total)+'</div><div class="lbl">Total DKK</div></div>';
-  h += '</div>';
-  h += '<div class="source">📋 FlexBillingHistoryTable · HistKeyNumber = '+esc(s.key)+' · BillingLogNum = '+esc(s.log)+'</div>';
-  h += '</div>';
+  h.push('<div class="card"><div class="card-title">Afregning</div>');
+  h.push('<div class="stats">');
+  h.push('<div class="stat"><div class="val">'+ts(s.start)+'</div><div class="lbl">Periode start</div></div>');
+  h.push('<div class="stat"><div class="val">'+ts(s.end)+'</div><div class="lbl">Periode slut</div></div>');
+  h.push('<div class="stat"><div class="val">'+fmt(s.kwh,2)+'</div><div class="lbl">kWh</div></div>');
+  h.push('<div class="stat"><div class="val">'+s.hours.ts.length+'</div><div class="lbl">Timer</div></div>');
+  h.push('<div class="stat"><div class="val total">'+fmt(s.total)+'</div><div class="lbl">Total DKK</div></div>');
+  h.push('</div>');
+  h.push('<div class="source">📋 FlexBillingHistoryTable · HistKeyNumber = '+esc(s.key)+' · BillingLogNum = '+esc(s.log)+'</div>');
+  h.push('</div>');
   
   // Warnings
   if (flags.length > 0) {
-    h += '<div class="card" style="border-color:var(--err)"><div class="card-title" style="color:var(--err)">⚠️ Advarsler</div>';
-    flags.forEach(function(f) { h += '<div style="padding:4px 0;font-size:0.85rem;">'+esc(f)+'</div>'; });
-    h += '</div>';
+    h.push('<div class="card" style="border-color:var(--err)"><div class="card-title" style="color:var(--err)">⚠️ Advarsler</div>');
+    flags.forEach(function(f) { h.push('<div style="padding:4px 0;font-size:0.85rem;">'+esc(f)+'</div>'); });
+    h.push('</div>');
   }
   
   // Component breakdown
-  h += '<div class="card"><div class="card-title">Komponentopdeling</div>';
-  h += '<div class="chart-bar">';
+  h.push('<div class="card"><div class="card-title">Komponentopdeling</div>');
+  h.push('<div class="chart-bar">');
   if (absTotal > 0) {
-    h += '<div class="seg spot" style="width:'+pct(Math.abs(s.spot),absTotal)+'" title="Spot: '+fmt(s.spot)+' DKK">Spot</div>';
-    h += '<div class="seg margin" style="width:'+pct(Math.abs(s.margin),absTotal)+'" title="Margin: '+fmt(s.margin)+' DKK">Margin</div>';
-    h += '<div class="seg tariff" style="width:'+pct(Math.abs(tariffTotal),absTotal)+'" title="Tariffer: '+fmt(tariffTotal)+' DKK">Tariffer</div>';
+    h.push('<div class="seg spot" style="width:'+pct(Math.abs(s.spot),absTotal)+'" title="Spot: '+fmt(s.spot)+' DKK">Spot</div>');
+    h.push('<div class="seg margin" style="width:'+pct(Math.abs(s.margin),absTotal)+'" title="Margin: '+fmt(s.margin)+' DKK">Margin</div>');
+    h.push('<div class="seg tariff" style="width:'+pct(Math.abs(tariffTotal),absTotal)+'" title="Tariffer: '+fmt(tariffTotal)+' DKK">Tariffer</div>');
   }
-  h += '</div>';
-  h += '<div class="breakdown">';
-  h += '<div class="component"><div class="comp-name">Spot <small>Σ kWh × PowerExchangePrice</small></div><div class="comp-amount val spot">'+fmt(s.spot)+'</div><div class="comp-pct">'+pct(Math.abs(s.spot),Math.abs(s.total))+'</div></div>';
-  h += '<div class="component"><div class="comp-name">Margin <small>Σ kWh × (CalculatedPrice − SpotPrice)</small></div><div class="comp-amount val margin">'+fmt(s.margin)+'</div><div class="comp-pct">'+pct(Math.abs(s.margin),Math.abs(s.total))+'</div></div>';
+  h.push('</div>');
+  h.push('<div class="breakdown">');
+  h.push('<div class="component"><div class="comp-name">Spot <small>Σ kWh × PowerExchangePrice</small></div><div class="comp-amount val spot">'+fmt(s.spot)+'</div><div class="comp-pct">'+pct(Math.abs(s.spot),absT)+'</div></div>');
+  h.push('<div class="component"><div class="comp-name">Margin <small>Σ kWh × (CalculatedPrice − SpotPrice)</small></div><div class="comp-amount val margin">'+fmt(s.margin)+'</div><div class="comp-pct">'+pct(Math.abs(s.margin),absT)+'</div></div>');
   s.tariffs.forEach(function(t) {
     var isWarn = t.avg > 5;
-    h += '<div class="component"><div class="comp-name">'+esc(t.desc)+' <small>['+esc(t.id)+']</small>';
-    if (isWarn) h += ' <span class="flag warn">⚠ TJEK</span>';
-    h += '</div><div class="comp-amount val '+(isWarn?'warn':'tariff')+'">'+fmt(t.amount)+'</div><div class="comp-pct">'+pct(Math.abs(t.amount),Math.abs(s.total))+'</div></div>';
+    h.push('<div class="component"><div class="comp-name">'+esc(t.desc)+' <small>['+esc(t.id)+']</small>');
+    if (isWarn) h.push(' <span class="flag warn">⚠ TJEK</span>');
+    h.push('</div><div class="comp-amount val '+(isWarn?'warn':'tariff')+'">'+fmt(t.amount)+'</div><div class="comp-pct">'+pct(Math.abs(t.amount),absT)+'</div></div>');
   });
-  h += '<div class="component" style="border-top:2px solid var(--border);padding-top:12px"><div class="comp-name" style="font-weight:700">Total</div><div class="comp-amount val total" style="font-size:1.1rem">'+fmt(s.total)+'</div><div class="comp-pct">100%</div></div>';
-  h += '</div></div>';
+  h.push('<div class="component" style="border-top:2px solid var(--border);padding-top:12px"><div class="comp-name" style="font-weight:700">Total</div><div class="comp-amount val total" style="font-size:1.1rem">'+fmt(s.total)+'</div><div class="comp-pct">100%</div></div>');
+  h.push('</div></div>');
   
   // Tariff provenance cards
   s.tariffs.forEach(function(t) {
     var p = t.prov;
     var isWarn = t.avg > 5;
-    h += '<div class="card"'+(isWarn?' style="border-color:var(--err)"':'')+'>';
-    h += '<div class="card-title">Tarif: '+esc(t.desc)+' ['+esc(t.id)+']</div>';
-    h += '<div class="stats" style="margin-bottom:12px">';
-    h += '<div class="stat"><div class="val '+(isWarn?'warn':'tariff')+'">'+fmt(t.amount)+'</div><div class="lbl">Beløb DKK</div></div>';
-    h += '<div class="stat"><div class="val">'+fmt(t.energy,2)+'</div><div class="lbl">kWh</div></div>';
-    h += '<div class="stat"><div class="val '+(isWarn?'warn':'')+'">'+fmtP(t.avg)+'</div><div class="lbl">Gns. DKK/kWh</div></div>';
-    h += '</div>';
+    h.push('<div class="card"'+(isWarn?' style="border-color:var(--err)"':'')+'>');
+    h.push('<div class="card-title">Tarif: '+esc(t.desc)+' ['+esc(t.id)+']</div>');
+    h.push('<div class="stats" style="margin-bottom:12px">');
+    h.push('<div class="stat"><div class="val '+(isWarn?'warn':'tariff')+'">'+fmt(t.amount)+'</div><div class="lbl">Beløb DKK</div></div>');
+    h.push('<div class="stat"><div class="val">'+fmt(t.energy,2)+'</div><div class="lbl">kWh</div></div>');
+    h.push('<div class="stat"><div class="val '+(isWarn?'warn':'')+'">'+fmtP(t.avg)+'</div><div class="lbl">Gns. DKK/kWh</div></div>');
+    h.push('</div>');
     
     if (p) {
-      h += '<div class="prov">';
-      h += '<div class="row"><span class="label">Kildetabel:</span><span class="value">EXU_PRICEELEMENTRATES</span></div>';
-      h += '<div class="row"><span class="label">PartyChargeTypeId:</span><span class="value">'+esc(t.id)+'</span></div>';
-      h += '<div class="row"><span class="label">Valgt takst startdato:</span><span class="value">'+ts(p.startDate)+'</span></div>';
-      h += '<div class="row"><span class="label">Taksttype:</span><span class="value">'+(p.isHourly ? 'Timedifferentieret (Price1..24)' : 'Flad takst (Price-kolonnen)')+'</span></div>';
-      h += '<div class="row"><span class="label">Flad takst værdi:</span><span class="value">'+fmtP(p.flat)+' DKK/kWh';
-      if (p.flat > 5) h += ' <span class="flag warn">MISTÆNKELIG — abonnementsbeløb?</span>';
-      h += '</span></div>';
+      h.push('<div class="prov">');
+      h.push('<div class="row"><span class="label">Kildetabel:</span><span class="value">EXU_PRICEELEMENTRATES</span></div>');
+      h.push('<div class="row"><span class="label">PartyChargeTypeId:</span><span class="value">'+esc(t.id)+'</span></div>');
+      h.push('<div class="row"><span class="label">Valgt takst startdato:</span><span class="value">'+ts(p.startDate)+'</span></div>');
+      h.push('<div class="row"><span class="label">Taksttype:</span><span class="value">'+(p.isHourly ? 'Timedifferentieret (Price1..24)' : 'Flad takst (Price-kolonnen)')+'</span></div>');
+      h.push('<div class="row"><span class="label">Flad takst værdi:</span><span class="value">'+fmtP(p.flat)+' DKK/kWh');
+      if (p.flat > 5) h.push(' <span class="flag warn">MISTÆNKELIG — abonnementsbeløb?</span>');
+      h.push('</span></div>');
       if (p.hourly) {
-        h += '<div class="row"><span class="label">Time-takster:</span><span class="value">['+p.hourly.map(function(r){return fmtP(r);}).join(', ')+']</span></div>';
+        h.push('<div class="row"><span class="label">Time-takster:</span><span class="value">['+p.hourly.map(function(r){return fmtP(r);}).join(', ')+']</span></div>');
       }
-      h += '<div class="row"><span class="label">Kandidatrækker:</span><span class="value">'+p.candidates+' rækker med StartDate ≤ periodestart';
-      if (p.candidates > 50) h += ' <span class="flag warn">HØJT — takst-tabel kan være per-GSRN</span>';
-      h += '</span></div>';
-      h += '<div class="rule">'+esc(p.rule)+'</div>';
-      h += '</div>';
+      h.push('<div class="row"><span class="label">Kandidatrækker:</span><span class="value">'+p.candidates+' rækker med StartDate ≤ periodestart');
+      if (p.candidates > 50) h.push(' <span class="flag warn">HØJT — takst-tabel kan være per-GSRN</span>');
+      h.push('</span></div>');
+      h.push('<div class="rule">'+esc(p.rule)+'</div>');
+      h.push('</div>');
     }
     
     // Expandable hourly tariff detail (recomputed from hours + rate)
-    h += '<details><summary>Vis beregning pr. time ('+s.hours.length+' rækker)</summary>';
-    h += '<div class="detail-wrap"><table class="tbl"><thead><tr><th>Tidspunkt</th><th class="r">kWh</th><th class="r">Takst DKK/kWh</th><th class="r">Beløb DKK</th></tr></thead><tbody>';
+    h.push('<details><summary>Vis beregning pr. time ('+s.hours.ts.length+' rækker)</summary>');
+    h.push('<div class="detail-wrap"><table class="tbl"><thead><tr><th>Tidspunkt</th><th class="r">kWh</th><th class="r">Takst DKK/kWh</th><th class="r">Beløb DKK</th></tr></thead><tbody>');
     var runTotal = 0;
-    s.hours.forEach(function(hr) {
-      var kwh = hr[1];
-      var rate;
-      if (p && p.isHourly && p.hourly) {
-        var hourIdx = new Date(hr[0]).getUTCHours();
-        rate = p.hourly[hourIdx] > 0 ? p.hourly[hourIdx] : p.flat;
-      } else {
-        rate = p ? p.flat : t.avg;
-      }
+    var hourRate = null;
+    if (p && p.isHourly && p.hourly) {
+      if (!hourOfDay) hourOfDay = s.hours.ts.map(function(t) { return new Date(t).getUTCHours(); });
+      hourRate = [];
+      for (var k = 0; k < 24; k++) hourRate.push(p.hourly[k] > 0 ? p.hourly[k] : p.flat);
+    }
+    var flatRate = p ? p.flat : t.avg;
+    for (var i = 0; i < s.hours.ts.length; i++) {
+      var kwh = s.hours.kwh[i];
+      var rate = hourRate ? hourRate[hourOfDay[i]] : flatRate;
       var amt = kwh * rate;
       runTotal += amt;
-      h += '<tr><td class="mono">'+tsH(hr[0])+'</td><td class="r">'+fmtK(kwh)+'</td><td class="r">'+fmtP(rate)+'</td><td class="r">'+fmtK(amt)+'</td></tr>';
-    });
+      h.push('<tr><td class="mono">'+tsH(s.hours.ts[i])+'</td><td class="r">'+fmtK(kwh)+'</td><td class="r">'+fmtP(rate)+'</td><td class="r">'+fmtK(amt)+'</td></tr>');
+    }
     var diff = Math.abs(runTotal - t.amount);
-    h += '<tr style="font-weight:700;border-top:2px solid var(--border)"><td>Total (genberegnet)</td><td></td><td></td><td class="r">'+fmt(runTotal,4);
-    h += diff > 0.01 ? ' <span class="flag warn">≠ '+fmt(t.amount,4)+'</span>' : ' <span class="flag ok">✓</span>';
-    h += '</td></tr>';
-    h += '</tbody></table></div></details>';
-    h += '</div>';
+    h.push('<tr style="font-weight:700;border-top:2px solid var(--border)"><td>Total (genberegnet)</td><td></td><td></td><td class="r">'+fmt(runTotal,4));
+    h.push(diff > 0.01 ? ' <span class="flag warn">≠ '+fmt(t.amount,4)+'</span>' : ' <span class="flag ok">✓</span>');
+    h.push('</td></tr>');
+    h.push('</tbody></table></div></details>');
+    h.push('</div>');
   });
   
   // Hourly consumption
-  h += '<div class="card"><div class="card-title">Timeforbrugsdata (FlexBillingHistoryLine)</div>';
-  h += '<div class="source">📋 FlexBillingHistoryLine · HistKeyNumber = '+esc(s.key)+' · '+s.hours.length+' rækker</div>';
-  h += '<details><summary>Vis alle '+s.hours.length+' timerækker</summary>';
-  h += '<div class="detail-wrap"><table class="tbl"><thead><tr><th>Tidspunkt</th><th class="r">kWh</th><th class="r">Spot DKK/kWh</th><th class="r">Beregnet DKK/kWh</th><th class="r">Margin DKK/kWh</th><th class="r">Spot DKK</th><th class="r">Margin DKK</th></tr></thead><tbody>';
+  h.push('<div class="card"><div class="card-title">Timeforbrugsdata (FlexBillingHistoryLine)</div>');
+  h.push('<div class="source">📋 FlexBillingHistoryLine · HistKeyNumber = '+esc(s.key)+' · '+s.hours.ts.length+' rækker</div>');
+  h.push('<details><summary>Vis alle '+s.hours.ts.length+' timerækker</summary>');
+  h.push('<div class="detail-wrap"><table class="tbl"><thead><tr><th>Tidspunkt</th><th class="r">kWh</th><th class="r">Spot DKK/kWh</th><th class="r">Beregnet DKK/kWh</th><th class="r">Margin DKK/kWh</th><th class="r">Spot DKK</th><th class="r">Margin DKK</th></tr></thead><tbody>');
   var tKwh=0, tSpot=0, tMarg=0;
-  s.hours.forEach(function(hr) {
-    var kwh=hr[1], spot=hr[2], calc=hr[3], marg=calc-spot;
+  for (var i = 0; i < s.hours.ts.length; i++) {
+    var kwh=s.hours.kwh[i], spot=s.hours.spot[i], calc=s.hours.calc[i], marg=calc-spot;
     var sAmt=kwh*spot, mAmt=kwh*marg;
     tKwh+=kwh; tSpot+=sAmt; tMarg+=mAmt;
-    h += '<tr><td class="mono">'+tsH(hr[0])+'</td><td class="r">'+fmtK(kwh)+'</td><td class="r">'+fmtP(spot)+'</td><td class="r">'+fmtP(calc)+'</td><td class="r">'+fmtP(marg)+'</td><td class="r">'+fmtK(sAmt)+'</td><td class="r">'+fmtK(mAmt)+'</td></tr>';
-  });
-  h += '<tr style="font-weight:700;border-top:2px solid var(--border)"><td>Total</td><td class="r">'+fmt(tKwh,4)+'</td><td></td><td></td><td></td><td class="r">'+fmt(tSpot,4)+'</td><td class="r">'+fmt(tMarg,4)+'</td></tr>';
-  h += '</tbody></table></div></details></div>';
+    h.push('<tr><td class="mono">'+tsH(s.hours.ts[i])+'</td><td class="r">'+fmtK(kwh)+'</td><td class="r">'+fmtP(spot)+'</td><td class="r">'+fmtP(calc)+'</td><td class="r">'+fmtP(marg)+'</td><td class="r">'+fmtK(sAmt)+'</td><td class="r">'+fmtK(mAmt)+'</td></tr>');
+  }
+  h.push('<tr style="font-weight:700;border-top:2px solid var(--border)"><td>Total</td><td class="r">'+fmt(tKwh,4)+'</td><td></td><td></td><td></td><td class="r">'+fmt(tSpot,4)+'</td><td class="r">'+fmt(tMarg,4)+'</td></tr>');
+  h.push('</tbody></table></div></details></div>');
   
-  document.getElementById('detail').innerHTML = h;
+  document.getElementById('detail').innerHTML = h.join('');
 }
 
 sel.value = 0;
@@ -342,6 +447,9 @@ render();
 </body>
 </html>'''
 
+# Split once so the (potentially huge) report JSON is written between the halves, never copied into the template
+HTML_HEAD, HTML_TAIL = (part.encode("utf-8") for part in HTML_TEMPLATE.split("__REPORT_DATA__", 1))
+
 
 if __name__ == "__main__":
     main()
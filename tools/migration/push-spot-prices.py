@@ -2,68 +2,134 @@
 """
 Push cached spot prices to WattsOn API.
 Usage: python3 push-spot-prices.py [--cache cache/spot-prices-dk1.json] [--url http://localhost:5100]
+(a .json.zst cache from fetch-spot-prices.py also works; needs the zstandard package)
 
 Converts from DKK/MWh (Energi Data Service) to DKK/kWh (WattsOn).
 Sends in batches to avoid timeout/memory issues.
 """
 
 import argparse
-import json
+import os
 import requests
 import sys
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import orjson
+    loads = orjson.loads
+    dumps = orjson.dumps
+except ImportError:  # orjson is optional; fall back to stdlib json
+    import json
+    loads = json.loads
+
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+try:
+    import ijson
+except ImportError:  # ijson is optional; without it the cache is always loaded whole
+    ijson = None
 
 BATCH_SIZE = 2000  # hours per API call (reduced from 5000 to avoid OOM in WSL2)
+MAX_WORKERS = 4  # concurrent POSTs — kept small to avoid overwhelming WSL2
+STREAM_MIN_BYTES = 32 * 1024 * 1024  # caches with this much JSON are stream-parsed (when ijson is installed)
+
+def open_cache(path: str):
+    """Open a cache file as a binary stream, decompressing .zst on the fly."""
+    f = open(path, "rb")
+    if path.endswith(".zst"):  # compressed cache from fetch-spot-prices.py
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(f)
+    return f
+
+def json_size(path: str) -> int:
+    """Bytes of JSON in a cache file — for .zst, the decompressed size recorded in the frame header."""
+    if not path.endswith(".zst"):
+        return os.path.getsize(path)
+    import zstandard
+    with open(path, "rb") as f:
+        size = zstandard.frame_content_size(f.read(18))  # 18 = largest zstd frame header
+    return size if size >= 0 else STREAM_MIN_BYTES  # size not recorded: assume large and stream
+
+def read_area(path: str):
+    """Read the top-level price area without parsing the prices that follow it."""
+    with open_cache(path) as f:
+        for prefix, event, value in ijson.parse(f):
+            if prefix == "area":
+                return value
+            if prefix == "" and event == "map_key" and value == "prices":
+                return None  # fetch-spot-prices.py writes area before prices
+    return None
+
+def iter_prices(path: str):
+    """Yield cached price rows one at a time without holding the whole file in memory."""
+    with open_cache(path) as f:
+        yield from ijson.items(f, "prices.item", use_float=True)
 
 def main():
     parser = argparse.ArgumentParser(description="Push spot prices to WattsOn")
-    parser.add_argument("--cache", default="cache/spot-prices-dk1.json", help="Cache file")
+    parser.add_argument("--cache", default="cache/spot-prices-dk1.json", help="Cache file (.json or .json.zst)")
     parser.add_argument("--url", default="http://localhost:5100", help="WattsOn API URL")
     parser.add_argument("--area", default=None, help="Override price area (default: from cache)")
     args = parser.parse_args()
 
-    with open(args.cache) as f:
-        cache = json.load(f)
-
-    area = args.area or cache.get("area", "DK1")
-    prices = cache["prices"]
+    if ijson is not None and json_size(args.cache) >= STREAM_MIN_BYTES:
+        area = args.area or read_area(args.cache) or "DK1"
+        prices = iter_prices(args.cache)
+    else:
+        with open_cache(args.cache) as f:
+            cache = loads(f.read())
+        area = args.area or cache.get("area", "DK1")
+        prices = cache["prices"]
     
-    # Convert DKK/MWh → DKK/kWh (÷1000)
-    points = []
-    skipped = 0
+    # Convert DKK/MWh → DKK/kWh (÷1000); Python round() is correctly rounded, unlike ndarray.round,
+    # so the persisted prices keep exactly the 8th decimal the API has always received
+    timestamps = []
+    kwh_prices = []
+    n_prices = 0
     for p in prices:
-        if p["spotPriceDkk"] is None:
-            skipped += 1
-            continue
-        points.append({
-            "timestamp": p["hourUtc"],
-            "priceDkkPerKwh": round(p["spotPriceDkk"] / 1000, 8),
-        })
+        n_prices += 1
+        if p["spotPriceDkk"] is not None:
+            timestamps.append(p["hourUtc"])
+            kwh_prices.append(round(p["spotPriceDkk"] / 1000, 8))
+    skipped = n_prices - len(timestamps)
+    points = [{"timestamp": t, "priceDkkPerKwh": v} for t, v in zip(timestamps, kwh_prices)]
     
+    # Range and min/max come from the collected columns rather than extra passes over points
     print(f"Pushing {len(points)} {area} spot prices ({skipped} skipped, null price)")
-    print(f"  Range: {points[0]['timestamp'][:10]} → {points[-1]['timestamp'][:10]}")
-    print(f"  Price: {min(p['priceDkkPerKwh'] for p in points):.6f} → {max(p['priceDkkPerKwh'] for p in points):.6f} DKK/kWh")
+    print(f"  Range: {timestamps[0][:10]} → {timestamps[-1][:10]}")
+    print(f"  Price: {min(kwh_prices):.6f} → {max(kwh_prices):.6f} DKK/kWh")
     
-    total_inserted = 0
-    total_updated = 0
+    # One keep-alive session shared by the worker threads, one pooled connection per worker
+    session = requests.Session()
+    session.headers["Content-Type"] = "application/json"
+    session.mount(args.url, requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS))
     
-    for i in range(0, len(points), BATCH_SIZE):
-        batch = points[i:i+BATCH_SIZE]
-        r = requests.post(f"{args.url}/api/spot-prices", json={
+    def post_batch(batch):
+        # Serialized up front (orjson when available) and sent as-is under the session's JSON content type
+        return session.post(f"{args.url}/api/spot-prices", data=dumps({
             "priceArea": area,
             "points": batch,
-        }, timeout=60)
-        
-        if r.status_code != 200:
-            print(f"  ERROR batch {i//BATCH_SIZE + 1}: {r.status_code} {r.text[:200]}")
-            sys.exit(1)
-        
-        result = r.json()
-        total_inserted += result.get("inserted", 0)
-        total_updated += result.get("updated", 0)
-        
-        end_idx = min(i + BATCH_SIZE, len(points))
-        print(f"  Batch {i//BATCH_SIZE + 1}: {batch[0]['timestamp'][:10]} → {batch[-1]['timestamp'][:10]} "
-              f"({result.get('inserted', 0)} new, {result.get('updated', 0)} updated)")
+        }), timeout=60)
+    
+    total_inserted = 0
+    total_updated = 0
+    
+    # Batches are posted concurrently; responses are tallied and reported in batch order
+    batches = [points[i:i+BATCH_SIZE] for i in range(0, len(points), BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        for n, (batch, r) in enumerate(zip(batches, pool.map(post_batch, batches)), 1):
+            if r.status_code != 200:
+                print(f"  ERROR batch {n}: {r.status_code} {r.text[:200]}")
+                pool.shutdown(cancel_futures=True)
+                sys.exit(1)
+            
+            result = r.json()
+            total_inserted += result.get("inserted", 0)
+            total_updated += result.get("updated", 0)
+            
+            print(f"  Batch {n}: {batch[0]['timestamp'][:10]} → {batch[-1]['timestamp'][:10]} "
+                  f"({result.get('inserted', 0)} new, {result.get('updated', 0)} updated)")
     
     print(f"\n✅ Done: {total_inserted} inserted, {total_updated} updated")
 
@@ -12,39 +12,99 @@ Usage:
   python3 recalculate-compare.py --cache cache/prod-405013-v10.json --spot cache/spot-prices-dk1.json --index 45 -v
 """
 
-import argparse, json, sys
+import argparse, math, os, sys
+from bisect import bisect_left, bisect_right
 from datetime import datetime, timedelta, timezone
-from collections import defaultdict
+from collections import Counter, defaultdict
+from functools import lru_cache
 
+try:
+    from orjson import loads
+except ImportError:  # orjson is optional; stdlib json accepts bytes too
+    from json import loads
 
+try:
+    import ijson
+except ImportError:  # ijson is optional; without it the spot cache is always loaded whole
+    ijson = None
+
+STREAM_MIN_BYTES = 32 * 1024 * 1024  # spot caches with this much JSON are stream-parsed (when ijson is installed)
+
+
+# Addon product names (not primary products), interned to match the interned productName values
+ADDON_NAMES = frozenset(map(sys.intern, (
+    "Grøn strøm",
+    "Leje af plads Anrenne/Mast/Koncent. El",
+    "Refusion af omk. for el-forbrug (el)",
+    "ØgetBal.geb.udenf-for",
+)))
+
+
+@lru_cache(maxsize=None)
 def norm(ts: str) -> str:
-    """Normalize timestamp: strip +00:00/Z for comparison."""
-    return ts.replace("+00:00", "").replace("Z", "")
+    """Normalize timestamp: strip a trailing +00:00/Z for comparison."""
+    if ts.endswith("+00:00"):
+        return ts[:-6]
+    if ts.endswith("Z"):
+        return ts[:-1]
+    return ts
 
 
 def parse_ts(ts: str) -> datetime:
-    """Parse ISO timestamp to datetime (UTC)."""
-    s = ts.replace("Z", "+00:00")
-    return datetime.fromisoformat(s)
+    """Parse ISO timestamp to datetime (UTC); fromisoformat only accepts a Z suffix from Python 3.11."""
+    return datetime.fromisoformat(ts[:-1] + "+00:00" if ts.endswith("Z") else ts)
+
+
+def open_cache(path: str):
+    """Open a cache file as a binary stream, decompressing .zst on the fly."""
+    f = open(path, "rb")
+    if path.endswith(".zst"):  # compressed cache from fetch-spot-prices.py
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(f)
+    return f
+
+
+def json_size(path: str) -> int:
+    """Bytes of JSON in a cache file — for .zst, the decompressed size recorded in the frame header."""
+    if not path.endswith(".zst"):
+        return os.path.getsize(path)
+    import zstandard
+    with open(path, "rb") as f:
+        size = zstandard.frame_content_size(f.read(18))  # 18 = largest zstd frame header
+    return size if size >= 0 else STREAM_MIN_BYTES  # size not recorded: assume large and stream
+
+
+def load_spot_prices(path: str):
+    """Return the spot cache's price rows: a parsed list, or a row stream for large caches."""
+    if ijson is not None and json_size(path) >= STREAM_MIN_BYTES:
+        return iter_spot_prices(path)
+    with open_cache(path) as f:
+        return loads(f.read())["prices"]
+
+
+def iter_spot_prices(path: str):
+    """Yield spot price rows one at a time without holding the whole file in memory."""
+    with open_cache(path) as f:
+        yield from ijson.items(f, "prices.item", use_float=True)
 
 
 def main():
     parser = argparse.ArgumentParser(description="Validate migrated settlements")
     parser.add_argument("--cache", required=True, help="Path to migration cache JSON")
-    parser.add_argument("--spot", required=True, help="Path to spot price cache JSON")
+    parser.add_argument("--spot", required=True, help="Path to spot price cache JSON (.json or .json.zst)")
     parser.add_argument("-v", "--verbose", action="store_true")
     parser.add_argument("--index", type=int, help="Single settlement index to check")
     parser.add_argument("--deep", action="store_true", help="Show per-hour price analysis for --index")
     args = parser.parse_args()
 
-    data = json.load(open(args.cache))
-    spot_cache = json.load(open(args.spot))
+    with open(args.cache, "rb") as f:
+        data = loads(f.read())
 
     # === Build lookups ===
 
     # Spot prices: normalized timestamp → DKK/kWh
     spot_lookup = {}
-    for p in spot_cache["prices"]:
+    for p in load_spot_prices(args.spot):
         if p["spotPriceDkk"] is not None:
             spot_lookup[norm(p["hourUtc"])] = p["spotPriceDkk"] / 1000.0
 
@@ -54,58 +114,65 @@ def main():
         obs_lookup[norm(o["timestamp"])] = o["kwh"]
 
     # Products by name
-    products = {p["name"]: p for p in data["products"]}
+    products = {sys.intern(p["name"]): p for p in data["products"]}
+
+    # Margin rates per product, sorted once with normalized bounds: (start, end or None, rate)
+    for p in products.values():
+        p["_rates_sorted"] = [
+            (norm(r["startDate"]), norm(r["endDate"]) if r.get("endDate") else None, r["rateDkkPerKwh"])
+            for r in sorted(p["rates"], key=lambda x: x["startDate"])
+        ]
 
     # Product periods (sorted)
     mp = data["customers"][0]["meteringPoints"][0]
     prod_periods = sorted(mp["productPeriods"], key=lambda pp: pp["start"])
+    for pp in prod_periods:
+        pp["productName"] = sys.intern(pp["productName"])
+        pp["_s"] = norm(pp["start"])
+        pp["_e"] = norm(pp.get("end") or "2099")
 
-    # Addon product names (not primary products)
-    addon_names = {
-        "Grøn strøm",
-        "Leje af plads Anrenne/Mast/Koncent. El",
-        "Refusion af omk. for el-forbrug (el)",
-        "ØgetBal.geb.udenf-for",
-    }
-
-    # Subscription prices: (chargeId) → sorted list of (norm_ts, monthly_price)
+    # Subscription prices: (chargeId) → (sorted norm_ts list, parallel monthly_price list)
     sub_prices = {}
     for p in data["prices"]:
         if p["type"] == "Abonnement":
             pts = sorted([(norm(pt["timestamp"]), pt["price"]) for pt in p["points"]])
-            sub_prices[p["chargeId"]] = pts
+            keys, vals = zip(*pts) if pts else ((), ())
+            sub_prices[p["chargeId"]] = (list(keys), list(vals))
 
     print(f"Cache: {len(data['settlements'])} settlements, {len(obs_lookup)} observations, "
           f"{len(spot_lookup)} spot hours, {len(products)} products")
-    obs_ts = sorted(obs_lookup.keys())
+    # Sorted observations, so each settlement period is a bisect slice rather than a full scan
+    obs_items = sorted(obs_lookup.items())
+    obs_ts = [t for t, _ in obs_items]
     if obs_ts:
         print(f"Obs range: {obs_ts[0][:10]} → {obs_ts[-1][:10]}")
     print()
 
     # === Helper functions ===
+    # Settlements share period starts, so product resolution is cached per ps_raw
 
+    @lru_cache(maxsize=None)
     def find_primary_product(period_start: str):
         """Find the primary (non-addon) product active at period_start."""
         ps = norm(period_start)
         for pp in reversed(prod_periods):
-            s = norm(pp["start"])
-            e = norm(pp.get("end") or "2099")
-            if s <= ps < e and pp["productName"] not in addon_names:
+            if pp["_s"] <= ps < pp["_e"] and pp["productName"] not in ADDON_NAMES:
                 return products.get(pp["productName"])
         return None
 
+    @lru_cache(maxsize=None)
     def find_addons(period_start: str):
         """Find addon products active at period_start."""
         ps = norm(period_start)
         addons = []
         for pp in prod_periods:
-            s = norm(pp["start"])
-            e = norm(pp.get("end") or "2099")
-            if s <= ps < e and pp["productName"] in addon_names:
+            if pp["_s"] <= ps < pp["_e"] and pp["productName"] in ADDON_NAMES:
                 prod = products.get(pp["productName"])
                 if prod:
                     addons.append(prod)
-        return addons
+        return tuple(addons)
+
+    margin_rates = {}  # (id(product), period_start) → rate
 
     def margin_rate_at(product, period_start: str) -> float:
         """Get the margin rate (DKK/kWh) for a product at period_start.
@@ -115,36 +182,46 @@ def main():
         This matches Xellent's behavior where a rate 'starting' on a quarter
         boundary applies to periods AFTER that boundary, not AT it.
         """
+        key = (id(product), period_start)
+        if key in margin_rates:
+            return margin_rates[key]
         ps = norm(period_start)
         rate = 0.0
-        for r in sorted(product["rates"], key=lambda x: x["startDate"]):
-            rs = norm(r["startDate"])
-            end = r.get("endDate")
+        for rs, end, r in product["_rates_sorted"]:
             if end:
                 # Range: startDate <= period < endDate
-                if rs <= ps and ps < norm(end):
-                    rate = r["rateDkkPerKwh"]
+                if rs <= ps and ps < end:
+                    rate = r
             else:
                 # Step function: strict less than
                 if rs < ps:
-                    rate = r["rateDkkPerKwh"]
+                    rate = r
+        margin_rates[key] = rate
         return rate
 
     def sub_price_at(charge_id: str, period_start: str) -> float:
         """Get subscription monthly price at period_start."""
-        ps = norm(period_start)
-        pts = sub_prices.get(charge_id, [])
-        val = 0.0
-        for t, p in pts:
-            if t <= ps:
-                val = p
-            else:
-                break
-        return val
+        keys, vals = sub_prices.get(charge_id, ([], []))
+        idx = bisect_right(keys, norm(period_start)) - 1
+        return vals[idx] if idx >= 0 else 0.0
 
     # === Validate each settlement ===
 
-    results = []
+    # Summary tallies, accumulated as settlements are validated
+    n_results = 0
+    with_obs_n = 0
+    ok_n = 0
+    all_consistent = True
+    margin_n = 0
+    total_margin_abs = 0.0
+    max_margin_abs = 0.0
+    spot_periods_n = 0
+    spot_total_sum = 0.0
+    missing_spot = 0
+    total_obs_match = 0
+    total_obs_mismatch = 0
+    total_obs_missing = 0
+    issue_types = defaultdict(int)
     for i, s in enumerate(data["settlements"]):
         if args.index is not None and i != args.index:
             continue
@@ -157,8 +234,9 @@ def main():
         margin_ref = s["marginAmountDkk"]
 
         # Find observations for this period
-        period_obs = {t: k for t, k in obs_lookup.items() if ps <= t < pe}
+        period_obs = dict(obs_items[bisect_left(obs_ts, ps):bisect_left(obs_ts, pe)])
         has_obs = len(period_obs) > 0
+        obs_sum = sum(period_obs.values()) if has_obs else 0.0
 
         # Find product
         prod = find_primary_product(ps_raw)
@@ -182,7 +260,7 @@ def main():
                 dh_total_ref += t["amountDkk"]
 
             if t.get("hourlyDetail"):
-                hd_sum = sum(h["amountDkk"] for h in t["hourlyDetail"])
+                hd_sum = math.fsum(h["amountDkk"] for h in t["hourlyDetail"])
                 diff = abs(t["amountDkk"] - hd_sum)
                 if diff > 0.01:
                     consistency_ok = False
@@ -238,7 +316,7 @@ def main():
         if prod:
             mr = margin_rate_at(prod, ps_raw)
             if has_obs:
-                recalc_margin = sum(period_obs.values()) * mr
+                recalc_margin = obs_sum * mr
             else:
                 # Use settlement's own total kWh
                 recalc_margin = total_kwh * mr
@@ -247,16 +325,19 @@ def main():
 
         # 3c: Addon product amounts
         addon_diffs = []
+        tl_by_id = {}  # first line wins per ID, as the next(...) scan it replaces did
+        for t in s["tariffLines"]:
+            tl_by_id.setdefault(t["partyChargeTypeId"], t)
         for addon in addons:
             addon_name = addon["name"]
             addon_rate = margin_rate_at(addon, ps_raw)
             # Find matching PRODUCT: tariff line
             product_key = f"PRODUCT:{addon_name}"
-            ref_line = next((t for t in s["tariffLines"] if t["partyChargeTypeId"] == product_key), None)
+            ref_line = tl_by_id.get(product_key)
             if ref_line:
                 ref_amt = ref_line["amountDkk"]
                 if has_obs:
-                    calc_amt = sum(period_obs.values()) * addon_rate
+                    calc_amt = obs_sum * addon_rate
                 else:
                     calc_amt = total_kwh * addon_rate
                 d = calc_amt - ref_amt
@@ -265,14 +346,14 @@ def main():
 
         # 3d: Subscription verification
         sub_diffs = []
+        # Period length in days, parsed once per settlement rather than per subscription line
+        ps_dt = parse_ts(ps_raw)
+        pe_dt = parse_ts(pe_raw)
+        days = (pe_dt - ps_dt).total_seconds() / 86400
         for t in s["tariffLines"]:
             if t["isSubscription"] and not t["partyChargeTypeId"].startswith("PRODUCT:"):
                 cid = t["partyChargeTypeId"]
                 monthly_rate = sub_price_at(cid, ps_raw)
-                # Calculate days in period
-                ps_dt = parse_ts(ps_raw)
-                pe_dt = parse_ts(pe_raw)
-                days = (pe_dt - ps_dt).total_seconds() / 86400
                 # Subscription amount = monthly_rate × (days / 30.4375 roughly)
                 # Actually in Xellent it's just the flat monthly amount
                 # WattsOn SettlementCalculator does: dailyPrice × days
@@ -299,20 +380,24 @@ def main():
 
         is_ok = len(issues) == 0
 
-        r = dict(
-            i=i, ps=ps, pe=pe, kwh=total_kwh, has_obs=has_obs,
-            obs_n=len(period_obs), prod=prod_name, model=model,
-            consistency_ok=consistency_ok, consistency_errors=consistency_errors,
-            obs_matched=obs_matched, obs_mismatched=obs_mismatched,
-            obs_missing=obs_missing, obs_errors=obs_errors,
-            recalc_spot=recalc_spot, recalc_margin=recalc_margin,
-            margin_ref=margin_ref, margin_diff=margin_diff,
-            addon_diffs=addon_diffs, sub_diffs=sub_diffs,
-            dh_total_ref=dh_total_ref, product_total_ref=product_total_ref,
-            issues=issues, ok=is_ok,
-            spot_missing=spot_missing_hours if recalc_spot is not None else None,
-        )
-        results.append(r)
+        n_results += 1
+        all_consistent = all_consistent and consistency_ok
+        for iss in issues:
+            issue_types[iss.split("(")[0]] += 1
+        if has_obs:
+            with_obs_n += 1
+            ok_n += is_ok
+            if margin_diff is not None:
+                margin_n += 1
+                total_margin_abs += abs(margin_diff)
+                max_margin_abs = max(max_margin_abs, abs(margin_diff))
+            if recalc_spot is not None:
+                spot_periods_n += 1
+                spot_total_sum += recalc_spot
+                missing_spot += spot_missing_hours
+            total_obs_match += obs_matched
+            total_obs_mismatch += obs_mismatched
+            total_obs_missing += obs_missing
 
         # === Print ===
         if not has_obs:
@@ -329,8 +414,8 @@ def main():
         spot_str = ""
         if recalc_spot is not None:
             spot_str = f" Spot={recalc_spot:>7.1f}"
-            if r["spot_missing"]:
-                spot_str += f"(!{r['spot_missing']}h)"
+            if spot_missing_hours:
+                spot_str += f"(!{spot_missing_hours}h)"
 
         obs_str = ""
         if has_obs:
@@ -368,9 +453,7 @@ def main():
                 print(f"\n  {cid} [{sub}]  amt={t['amountDkk']:.4f}  kwh={t['energyKwh']:.1f}  avg={t['avgUnitPrice']}")
                 if t.get("hourlyDetail") and not t["isSubscription"]:
                     hd = t["hourlyDetail"]
-                    rates = defaultdict(int)
-                    for h in hd:
-                        rates[h["rateDkkPerKwh"]] += 1
+                    rates = Counter(h["rateDkkPerKwh"] for h in hd)
                     print(f"    Rates: {dict(sorted(rates.items()))}")
                     # Show first/last 3 hours
                     for h in hd[:3]:
@@ -387,50 +470,33 @@ def main():
                               f"amt={h['amountDkk']:.6f}  obs={obs_kwh}  spot={sp}")
 
     # === Summary ===
-    with_obs = [r for r in results if r["has_obs"]]
-    without_obs = [r for r in results if not r["has_obs"]]
-    ok_list = [r for r in with_obs if r["ok"]]
-
     print(f"\n{'═' * 60}")
-    print(f"  Total settlements:  {len(results)}")
-    print(f"  With observations:  {len(with_obs)}")
-    print(f"  Without (skipped):  {len(without_obs)}")
-    if with_obs:
-        print(f"  ✅ Validated:       {len(ok_list)}/{len(with_obs)}")
+    print(f"  Total settlements:  {n_results}")
+    print(f"  With observations:  {with_obs_n}")
+    print(f"  Without (skipped):  {n_results - with_obs_n}")
+    if with_obs_n:
+        print(f"  ✅ Validated:       {ok_n}/{with_obs_n}")
 
         # Consistency check across all
-        all_consistent = all(r["consistency_ok"] for r in results)
         print(f"  Internal consistency: {'✅ ALL' if all_consistent else '❌ SOME FAILED'}")
 
         # Margin analysis
-        margin_diffs = [r["margin_diff"] for r in with_obs if r["margin_diff"] is not None]
-        if margin_diffs:
-            total_margin_diff = sum(abs(d) for d in margin_diffs)
-            max_margin_diff = max(abs(d) for d in margin_diffs)
-            print(f"  Margin Σ|Δ|:        {total_margin_diff:.2f} DKK (max={max_margin_diff:.2f})")
+        if margin_n:
+            print(f"  Margin Σ|Δ|:        {total_margin_abs:.2f} DKK (max={max_margin_abs:.2f})")
 
         # Spot analysis
-        spot_totals = [r["recalc_spot"] for r in with_obs if r["recalc_spot"] is not None]
-        if spot_totals:
-            print(f"  Spot total (recalc): {sum(spot_totals):.2f} DKK across {len(spot_totals)} periods")
-            missing = sum(r["spot_missing"] for r in with_obs if r["spot_missing"])
-            if missing:
-                print(f"  ⚠️  Missing spot hours: {missing}")
+        if spot_periods_n:
+            print(f"  Spot total (recalc): {spot_total_sum:.2f} DKK across {spot_periods_n} periods")
+            if missing_spot:
+                print(f"  ⚠️  Missing spot hours: {missing_spot}")
 
         # Observation analysis
-        total_obs_match = sum(r["obs_matched"] for r in with_obs)
-        total_obs_mismatch = sum(r["obs_mismatched"] for r in with_obs)
-        total_obs_missing = sum(r["obs_missing"] for r in with_obs)
         print(f"  Obs matching:       {total_obs_match} ok, {total_obs_mismatch} mismatch, {total_obs_missing} missing")
 
-        if with_obs and not ok_list:
+        if not ok_n:
             print("\n  ⚠️  All settlements with obs have issues — check with -v for details")
 
     # Issue breakdown
-    issue_types = defaultdict(int)
-    for r in results:
-        for iss in r["issues"]:
-            issue_types[iss.split("(")[0]] += 1
     if issue_types:
         print(f"\n  Issue breakdown:")
         for k, v in sorted(issue_types.items(), key=lambda x: -x[1]):